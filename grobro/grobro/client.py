@@ -7,7 +7,10 @@ Client for the grobro mqtt side, handling messages from/to
 import os
 import struct
 import logging
+import socket
 import ssl
+import time
+from collections import OrderedDict
 from typing import Callable
 
 
@@ -29,7 +32,7 @@ from grobro.model.growatt_registers import GrowattRegisterEnumTypes
 from grobro.model.growatt_registers import HomeAssistantHoldingRegisterInput
 from grobro.model.growatt_registers import HomeAssistantHoldingRegisterValue
 from grobro.model.growatt_registers import HomeAssistantInputRegister
-from grobro.model.growatt_registers import KNOWN_NEO_REGISTERS, KNOWN_NOAH_REGISTERS, KNOWN_NEXA_REGISTERS, KNOWN_SPF_REGISTERS
+from grobro.model.growatt_registers import get_known_registers
 
 
 LOG = logging.getLogger(__name__)
@@ -47,6 +50,10 @@ else:
     GROWATT_CLOUD_ENABLED = False
     GROWATT_CLOUD_FILTER = set()
 
+# Upper bound for concurrent growatt cloud connections, least recently used are dropped.
+# 0 or less disables the cap.
+MAX_FORWARD_CLIENTS = int(os.getenv("MAX_FORWARD_CLIENTS", "32"))
+
 DUMP_MESSAGES = os.getenv("DUMP_MESSAGES", "false").lower() == "true"
 DUMP_DIR = os.getenv("DUMP_DIR", "/dump")
 
@@ -70,7 +77,7 @@ class Client:
 
     _client: mqtt.Client
     _forward_mqtt_config: model.MQTTConfig
-    _forward_clients = {}
+    _forward_clients: OrderedDict[str, mqtt.Client]
 
     def __init__(self, grobro_mqtt: MQTTConfig, forward_mqtt: MQTTConfig):
         LOG.info(
@@ -90,6 +97,7 @@ class Client:
         self._client.on_message = self.__on_message
         self._client.on_connect = self.__on_connect
         self._forward_mqtt_config = forward_mqtt
+        self._forward_clients = OrderedDict()
 
     def start(self):
         LOG.debug("GroBro: Start")
@@ -108,7 +116,8 @@ class Client:
         final_payload = append_crc(scrambled)
 
         topic = f"s/33/{cmd.device_id}"
-        LOG.debug("Send command: %s: %s: %s", type(cmd).__name__, topic, cmd)
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug("Send command: %s: %s: %s", type(cmd).__name__, topic, cmd)
 
         result = self._client.publish(
             topic,
@@ -124,18 +133,19 @@ class Client:
       self._client.subscribe("c/#")      
 
     def __on_message(self, client, userdata, msg: MQTTMessage):
+        props = get_user_properties(msg)
         # check for forwarded messages and ignore them
-        forwarded_for = get_property(msg, "forwarded-for")
+        forwarded_for = props.get("forwarded-for")
         if forwarded_for and forwarded_for in ["ha", "growatt"]:
             LOG.debug("Message forwarded from %s. Skipping...", forwarded_for)
             return
 
-        file = get_property(msg, "file")
+        file = props.get("file")
         LOG.debug(f"Received message (%s): %s: %s", file, msg.topic, msg.payload)
         if DUMP_MESSAGES:
             dump_message_binary(msg.topic, msg.payload)
         try:
-            device_id = msg.topic.split("/")[-1]
+            device_id = msg.topic.rpartition("/")[2]
             if GROWATT_CLOUD_ENABLED:
                 if GROWATT_CLOUD == "true" or device_id in GROWATT_CLOUD_FILTER:
                     try:
@@ -150,20 +160,13 @@ class Client:
                         LOG.error(f"Forwarding to GROWATT_CLOUD failed: {e}")
 
             unscrambled = parser.unscramble(msg.payload)
-            LOG.debug(f"Received: %s %s", msg.topic, unscrambled.hex(" "))
+            if LOG.isEnabledFor(logging.DEBUG):
+                LOG.debug("Received: %s %s", msg.topic, unscrambled.hex(" "))
 
             modbus_message = GrowattModbusMessage.parse_grobro(unscrambled)
             LOG.debug("Received modbus message: %s", modbus_message)
             if modbus_message:
-                known_registers = None
-                if device_id.startswith("QMN"):
-                    known_registers = KNOWN_NEO_REGISTERS
-                elif device_id.startswith("0PVP"):
-                    known_registers = KNOWN_NOAH_REGISTERS
-                elif device_id.startswith("0HVR"):
-                    known_registers = KNOWN_NEXA_REGISTERS
-                elif device_id.startswith("HAQ"):
-                    known_registers = KNOWN_SPF_REGISTERS
+                known_registers = get_known_registers(device_id)
                 if not known_registers:
                     LOG.info("Modbus message from unknown device type: %s", device_id)
                     return
@@ -174,18 +177,17 @@ class Client:
                 ):
                     state = HomeAssistantHoldingRegisterInput(device_id=device_id)
                     
-                    for name, register in known_registers.holding_registers.items():
-                        data_raw = modbus_message.get_data(register.growatt.position)
-                        value = register.growatt.data.parse(data_raw)
+                    for name, read, ha_register in known_registers.holding_plan:
+                        value = read(modbus_message)
                         if value is None:
                             continue
-                        if register.homeassistant.type=="switch":
+                        if ha_register.type=="switch":
                             value = "ON" if value==1 else "OFF"
                         state.payload.append(
                             HomeAssistantHoldingRegisterValue(
                                 name=name,
                                 value=value,
-                                register=register.homeassistant,
+                                register_def=ha_register,
                             )
                         )
                     self.on_holding_register_input(state)
@@ -193,10 +195,8 @@ class Client:
                 if modbus_message.function == GrowattModbusFunction.READ_INPUT_REGISTER:
                     state = HomeAssistantInputRegister(device_id=device_id)
                     
-                    for name, register in known_registers.input_registers.items():
-                        data_raw = modbus_message.get_data(register.growatt.position)
-                        data_type = register.growatt.data
-                        value = register.growatt.data.parse(data_raw)
+                    for name, read in known_registers.input_plan:
+                        value = read(modbus_message)
                         # TODO: this is a workaround for broken messages sent by neo inverters at night.
                         # They emmit state updates with incredible high wattage, which spoils HA statistics.
                         # Assuming no one runs a balkony plant with more than a million peak wattage, we drop such messages.
@@ -227,7 +227,8 @@ class Client:
                 LOG.info(f"Received config message for {device_id}")
                 return
 
-            LOG.debug("Unknown msg_type %s: %s", msg_type, unscrambled.hex())
+            if LOG.isEnabledFor(logging.DEBUG):
+                LOG.debug("Unknown msg_type %s: %s", msg_type, unscrambled.hex())
         except Exception as e:
             LOG.error(f"Processing message: {e}")
 
@@ -235,7 +236,7 @@ class Client:
         if DUMP_MESSAGES:
             dump_message_binary(msg.topic, msg.payload)
         try:
-            device_id = msg.topic.split("/")[-1]
+            device_id = msg.topic.rpartition("/")[2]
             if not GROWATT_CLOUD_ENABLED:
                 return
             if GROWATT_CLOUD != "true" and device_id not in GROWATT_CLOUD_FILTER:
@@ -248,7 +249,7 @@ class Client:
             # We need to publish the messages from Growatt on the Topic
             # s/33/{deviceid}. Growatt sends them on Topic s/{deviceid}
             self._client.publish(
-                msg.topic.split("/")[0] + "/33/" + device_id,
+                msg.topic.partition("/")[0] + "/33/" + device_id,
                 payload=msg.payload,
                 qos=msg.qos,
                 retain=msg.retain,
@@ -259,7 +260,13 @@ class Client:
 
     # Setup Growatt MQTT broker for forwarding messages
     def __connect_to_growatt_server(self, client_id):
-        if f"forward_client_{client_id}" not in self._forward_clients:
+        # Growatt identifies devices by their mqtt client id, so every
+        # forwarded device needs its own connection.
+        key = f"forward_client_{client_id}"
+        client = self._forward_clients.get(key)
+        if client is not None:
+            self._forward_clients.move_to_end(key)
+        else:
             LOG.info(
                 "Connecting to Growatt broker at '%s:%s', subscribed to '+/%s'",
                 self._forward_mqtt_config.host,
@@ -273,6 +280,8 @@ class Client:
             client.tls_set(cert_reqs=ssl.CERT_NONE)
             client.tls_insecure_set(True)
             client.on_message = self.__on_message_forward_client
+            # set on every socket, paho opens a new one on each reconnect
+            client.on_socket_open = _set_tcp_nodelay
             client.connect(
                 self._forward_mqtt_config.host,
                 self._forward_mqtt_config.port,
@@ -280,8 +289,18 @@ class Client:
             )
             client.subscribe(f"+/{client_id}")
             client.loop_start()
-            self._forward_clients[f"forward_client_{client_id}"] = client
-        return self._forward_clients[f"forward_client_{client_id}"]
+            self._forward_clients[key] = client
+            if 0 < MAX_FORWARD_CLIENTS < len(self._forward_clients):
+                evicted_key, evicted = self._forward_clients.popitem(last=False)
+                LOG.info("Disconnecting least recently used Growatt forward client %s", evicted_key)
+                evicted.loop_stop()
+                evicted.disconnect()
+        return client
+
+
+def _set_tcp_nodelay(client, userdata, sock):
+    # forwarded messages are small, don't let Nagle delay them
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
 
 # Ensure that the dump directory exists
@@ -290,16 +309,19 @@ if DUMP_MESSAGES and not os.path.exists(DUMP_DIR):
     LOG.info(f"Dump directory created: {DUMP_DIR}")
 
 
+# Topic directories already created by dump_message_binary
+_DUMP_DIRS: set[str] = set()
+
+
 def dump_message_binary(topic, payload):
     try:
         # Build path following topic structure
-        topic_parts = topic.strip("/").split("/")
-        dir_path = os.path.join(DUMP_DIR, *topic_parts)
-        os.makedirs(dir_path, exist_ok=True)
+        dir_path = os.path.join(DUMP_DIR, topic.strip("/"))
+        if dir_path not in _DUMP_DIRS:
+            os.makedirs(dir_path, exist_ok=True)
+            _DUMP_DIRS.add(dir_path)
 
         # Write each message to a new file with timestamp
-        import time
-
         timestamp = int(time.time() * 1000)
         file_path = os.path.join(dir_path, f"{timestamp}.bin")
 
@@ -309,9 +331,6 @@ def dump_message_binary(topic, payload):
         LOG.error(f"Failed to dump message for topic {topic}: {e}")
 
 
-def get_property(msg, prop) -> str:
-    props = msg.properties.json().get("UserProperty", [])
-    for key, value in props:
-        if key == prop:
-            return value
-    return None
+def get_user_properties(msg) -> dict[str, str]:
+    user_props = getattr(msg.properties, "UserProperty", None)
+    return dict(user_props) if user_props else {}
@@ -9,15 +9,18 @@ from typing import Callable, Optional
 
 import paho.mqtt.client as mqtt
 
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib encoder
+    orjson = None
+
 import grobro.model as model
 from grobro.model.growatt_registers import (
     HomeAssistantInputRegister,
     HomeAssistantHoldingRegisterInput,
     GroBroRegisters,
-    KNOWN_NEO_REGISTERS,
-    KNOWN_NOAH_REGISTERS,
-    KNOWN_NEXA_REGISTERS,
-    KNOWN_SPF_REGISTERS
+    get_device_type_name,
+    get_known_registers,
 )
 from grobro.model.modbus_message import GrowattModbusFunction
 from grobro.model.modbus_function import (
@@ -32,48 +35,26 @@ PUBLISH_SENSORS_RETAINED = os.getenv("PUBLISH_SENSORS_RETAINED", "False").lower(
 MAX_SLOTS = int(os.getenv("MAX_SLOTS", "1"))
 LOG = logging.getLogger(__name__)
 
+# Discovery payloads only differ per device in the device id and the device
+# info, so they are serialized once per register set and filled in per device.
+DISCOVERY_DEVICE_ID = "__GROBRO_DEVICE_ID__"
+DISCOVERY_DEVICE_INFO = "__GROBRO_DEVICE_INFO__"
+_DISCOVERY_TEMPLATES: dict[int, str] = {}
+
 
 # ------------------- Helpfunctions -------------------
 
-def get_known_registers(device_id: str) -> Optional[GroBroRegisters]:
-    """Ermittle passende Register-Sammlung anhand device_id-Präfix."""
-    if device_id.startswith("QMN"):
-        return KNOWN_NEO_REGISTERS
-    if device_id.startswith("0PVP"):
-        return KNOWN_NOAH_REGISTERS
-    if device_id.startswith("0HVR"):
-        return KNOWN_NEXA_REGISTERS
-    if device_id.startswith("HAQ"):
-        return KNOWN_SPF_REGISTERS
-    return None
-
-
-def get_device_type_name(device_id: str) -> str:
-    """Ermittle Klartext-Typname anhand der device_id."""
-    if device_id.startswith("QMN"):
-        return "NEO"
-    if device_id.startswith("0PVP"):
-        return "NOAH"
-    if device_id.startswith("0HVR"):
-        return "NEXA"
-    if device_id.startswith("HAQ"):
-        return "SPF"
-    return "UNKNOWN"
-
-
-def map_enum_value(reg, value):
+def dump_json(obj, sort_keys: bool = False) -> bytes:
+    """Serialisiert kompaktes JSON, bevorzugt mit orjson."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":")).encode()
+
+
+def map_enum_value(enum_values: dict, value):
     """Wandelt ENUM-INT_MAP-Werte in Klartext um (falls vorhanden)."""
-    try:
-        data = getattr(reg.growatt, "data", None)
-        if not data or getattr(data, "data_type", None) != "ENUM":
-            return value
-        enum_opts = getattr(data, "enum_options", None)
-        if not enum_opts or getattr(enum_opts, "enum_type", None) != "INT_MAP":
-            return value
-        return enum_opts.values.get(str(value), enum_opts.values.get(value, str(value)))
-    except Exception as e:
-        LOG.warning("Enum mapping failed for %s=%s: %s", reg, value, e)
-        return value
+    label = enum_values.get(value)
+    return str(value) if label is None else label
 
 
 def make_modbus_command(device_id: str, func: GrowattModbusFunction, register_no: int, value: Optional[int] = None) -> GrowattModbusFunctionSingle:
@@ -86,6 +67,107 @@ def make_modbus_command(device_id: str, func: GrowattModbusFunction, register_no
     )
 
 
+def build_discovery_payload(device_id: str, known_registers: GroBroRegisters) -> dict:
+    """Baut das Discovery-Payload (ohne Geräteinfo) für eine Register-Sammlung."""
+    # prepare discovery payload
+    payload: dict = {
+        "avty_t": f"{HA_BASE_TOPIC}/grobro/{device_id}/availability",
+        "o": {"name": "grobro", "url": "https://github.com/robertzaage/GroBro"},
+        "cmps": {},
+    }
+
+    # Commands
+    for cmd_name, cmd in known_registers.holding_registers.items():
+        if not cmd.homeassistant.publish:
+            continue
+
+        if cmd_name.startswith("slot"):
+            try:
+                if int(cmd_name[4]) > MAX_SLOTS:
+                    continue
+            except ValueError:
+                continue
+
+        unique_id = f"grobro_{device_id}_cmd_{cmd_name}"
+        cmd_type = cmd.homeassistant.type
+        payload["cmps"][unique_id] = {
+            "command_topic": f"{HA_BASE_TOPIC}/{cmd_type}/grobro/{device_id}/{cmd_name}/set",
+            "state_topic": f"{HA_BASE_TOPIC}/{cmd_type}/grobro/{device_id}/{cmd_name}/get",
+            "platform": cmd_type,
+            "unique_id": unique_id,
+            **cmd.homeassistant.dict(exclude_none=True),
+        }
+
+    # Read-All Button
+    payload["cmps"][f"grobro_{device_id}_cmd_read_all"] = {
+        "command_topic": f"{HA_BASE_TOPIC}/button/grobro/{device_id}/read_all/read",
+        "platform": "button",
+        "unique_id": f"grobro_{device_id}_cmd_read_all",
+        "name": "Read All Values",
+    }
+
+    # States
+    for state_name, state in known_registers.input_registers.items():
+        if not state.homeassistant.publish:
+            continue
+        unique_id = f"grobro_{device_id}_{state_name}"
+        payload["cmps"][unique_id] = {
+            "platform": "sensor",
+            "name": state.homeassistant.name,
+            "state_topic": f"{HA_BASE_TOPIC}/grobro/{device_id}/state",
+            "value_template": f"{{{{ value_json['{state_name}'] }}}}",
+            "unique_id": unique_id,
+            "device_class": state.homeassistant.device_class,
+            "state_class": state.homeassistant.state_class,
+            "unit_of_measurement": state.homeassistant.unit_of_measurement,
+            "icon": state.homeassistant.icon,
+        }
+
+    # Serial Number Entity
+    serial_unique_id = f"grobro_{device_id}_serial"
+    payload["cmps"][serial_unique_id] = {
+        "platform": "sensor",
+        "name": "Device SN",
+        "state_topic": f"{HA_BASE_TOPIC}/grobro/{device_id}/serial",
+        "unique_id": serial_unique_id,
+        "icon": "mdi:identifier",
+    }
+
+    # Device Type Entity
+    type_unique_id = f"grobro_{device_id}_type"
+    payload["cmps"][type_unique_id] = {
+        "platform": "sensor",
+        "name": "Device Type",
+        "state_topic": f"{HA_BASE_TOPIC}/grobro/{device_id}/type",
+        "unique_id": type_unique_id,
+        "icon": "mdi:chip",
+    }
+
+    # Online Entity
+    if DEVICE_TIMEOUT > 0 and AVAILABILITY_SENSOR:
+        online_unique_id = f"grobro_{device_id}_online"
+        payload["cmps"][online_unique_id] = {
+            "platform": "binary_sensor",
+            "name": "Online",
+            "state_topic": f"{HA_BASE_TOPIC}/grobro/{device_id}/online",
+            "device_class": "connectivity",
+            "unique_id": online_unique_id,
+        }
+
+    return payload
+
+
+def get_discovery_template(known_registers: GroBroRegisters) -> str:
+    """Liefert das serialisierte Discovery-Payload mit Platzhaltern für device_id und Geräteinfo."""
+    template = _DISCOVERY_TEMPLATES.get(id(known_registers))
+    if template is None:
+        payload = build_discovery_payload(DISCOVERY_DEVICE_ID, known_registers)
+        payload["dev"] = DISCOVERY_DEVICE_INFO
+        template = dump_json(payload, sort_keys=True).decode()
+        _DISCOVERY_TEMPLATES[id(known_registers)] = template
+    return template
+
+
 # ------------------- Client-Class -------------------
 
 class Client:
@@ -123,6 +205,8 @@ class Client:
                     self._config_cache[config.device_id] = config
 
         self._discovery_payload_cache: dict[str, str] = {}
+        # retained migration messages only need to be sent once per device
+        self._migrated_devices: set[str] = set()
 
     # ------------------- Lifecycle -------------------
 
@@ -160,32 +244,25 @@ class Client:
         if DEVICE_TIMEOUT > 0:
             self.__reset_device_timer(state.device_id)
 
-        # ENUM Mapping
-        payload = dict(state.payload)
+        # state is built per message, so its payload is updated in place
+        payload = state.payload
         known_registers = get_known_registers(state.device_id)
 
-        # Replace invalid battery temperatures (-273) with None
         if known_registers:
-            for key, value in list(payload.items()):
-                reg = known_registers.input_registers.get(key)
-                if not reg:
-                    continue
+            # Replace invalid battery temperatures (-273) with None
+            # key == "bat1_temp", "bat2_temp", etc.
+            for key, value in payload.items():
+                if value == -273.1 and key.startswith("bat") and key.endswith("_temp"):
+                    payload[key] = None
 
-                # Identify batX_temp sensors
-                name = key  # key == "bat1_temp", "bat2_temp", etc.
-                if name.startswith("bat") and name.endswith("_temp"):
-                    if isinstance(value, (int, float)) and value == -273.1:
-                        payload[key] = None
-                
-        if known_registers:
-            for key, value in list(payload.items()):
-                reg = known_registers.input_registers.get(key)
-                if reg:
-                    payload[key] = map_enum_value(reg, value)
+            # ENUM Mapping, only for the INT_MAP registers of this device type
+            for key, enum_values in known_registers.input_enum_values.items():
+                if key in payload:
+                    payload[key] = map_enum_value(enum_values, payload[key])
 
         # State publish
         topic = f"{HA_BASE_TOPIC}/grobro/{state.device_id}/state"
-        self._client.publish(topic, json.dumps(payload, separators=(",", ":")), retain=PUBLISH_SENSORS_RETAINED)
+        self._client.publish(topic, dump_json(payload), retain=PUBLISH_SENSORS_RETAINED)
 
 
     def publish_holding_register_input(self, ha_input: HomeAssistantHoldingRegisterInput):
@@ -203,7 +280,8 @@ class Client:
         LOG.debug(f"Connected to HA MQTT server with result code {reason_code}")
 
     def __on_message(self, client, userdata, msg: mqtt.MQTTMessage):
-        parts = msg.topic.removeprefix(f"{HA_BASE_TOPIC}/").split("/")
+        # maxsplit keeps deeper topics at six parts, so they still fail the check
+        parts = msg.topic.removeprefix(f"{HA_BASE_TOPIC}/").split("/", 5)
         if len(parts) != 5 or parts[0] not in {"number", "button", "switch"}:
             return
         cmd_type, _, device_id, cmd_name, action = parts
@@ -297,114 +375,46 @@ class Client:
             LOG.info("Unable to publish unknown device type: %s", device_id)
             return
 
-        self.__migrate_entity_discovery(device_id, known_registers)
-
-        topic = f"{HA_BASE_TOPIC}/device/{device_id}/config"
-
-        # prepare discovery payload
-        payload: dict = {
-            "dev": self.__device_info_from_config(device_id),
-            "avty_t": f"{HA_BASE_TOPIC}/grobro/{device_id}/availability",
-            "o": {"name": "grobro", "url": "https://github.com/robertzaage/GroBro"},
-            "cmps": {},
-        }
-
-        # Commands
-        for cmd_name, cmd in known_registers.holding_registers.items():
-            if not cmd.homeassistant.publish:
-                continue
-
-            if cmd_name.startswith("slot"):
-                try:
-                    if int(cmd_name[4]) > MAX_SLOTS:
-                        continue
-                except ValueError:
-                    continue
-
-            unique_id = f"grobro_{device_id}_cmd_{cmd_name}"
-            cmd_type = cmd.homeassistant.type
-            payload["cmps"][unique_id] = {
-                "command_topic": f"{HA_BASE_TOPIC}/{cmd_type}/grobro/{device_id}/{cmd_name}/set",
-                "state_topic": f"{HA_BASE_TOPIC}/{cmd_type}/grobro/{device_id}/{cmd_name}/get",
-                "platform": cmd_type,
-                "unique_id": unique_id,
-                **cmd.homeassistant.dict(exclude_none=True),
-            }
-
-        # Read-All Button
-        payload["cmps"][f"grobro_{device_id}_cmd_read_all"] = {
-            "command_topic": f"{HA_BASE_TOPIC}/button/grobro/{device_id}/read_all/read",
-            "platform": "button",
-            "unique_id": f"grobro_{device_id}_cmd_read_all",
-            "name": "Read All Values",
-        }
-
-        # States
-        for state_name, state in known_registers.input_registers.items():
-            if not state.homeassistant.publish:
-                continue
-            unique_id = f"grobro_{device_id}_{state_name}"
-            payload["cmps"][unique_id] = {
-                "platform": "sensor",
-                "name": state.homeassistant.name,
-                "state_topic": f"{HA_BASE_TOPIC}/grobro/{device_id}/state",
-                "value_template": f"{{{{ value_json['{state_name}'] }}}}",
-                "unique_id": unique_id,
-                "device_class": state.homeassistant.device_class,
-                "state_class": state.homeassistant.state_class,
-                "unit_of_measurement": state.homeassistant.unit_of_measurement,
-                "icon": state.homeassistant.icon,
-            }
-
-        # Serial Number Entity
-        serial_unique_id = f"grobro_{device_id}_serial"
-        payload["cmps"][serial_unique_id] = {
-            "platform": "sensor",
-            "name": "Device SN",
-            "state_topic": f"{HA_BASE_TOPIC}/grobro/{device_id}/serial",
-            "unique_id": serial_unique_id,
-            "icon": "mdi:identifier",
-        }
+        if device_id in self._discovery_cache:
+            # published and not invalidated by set_config since, so the
+            # payload cannot have changed
+            self.__publish_device_states(device_id)
+            return
 
-        # Device Type Entity
-        type_unique_id = f"grobro_{device_id}_type"
-        payload["cmps"][type_unique_id] = {
-            "platform": "sensor",
-            "name": "Device Type",
-            "state_topic": f"{HA_BASE_TOPIC}/grobro/{device_id}/type",
-            "unique_id": type_unique_id,
-            "icon": "mdi:chip",
-        }
+        if device_id not in self._migrated_devices:
+            self.__migrate_entity_discovery(device_id, known_registers)
+            self._migrated_devices.add(device_id)
 
-        # Online Entity
-        if DEVICE_TIMEOUT > 0 and AVAILABILITY_SENSOR:
-            online_unique_id = f"grobro_{device_id}_online"
-            payload["cmps"][online_unique_id] = {
-                "platform": "binary_sensor",
-                "name": "Online",
-                "state_topic": f"{HA_BASE_TOPIC}/grobro/{device_id}/online",
-                "device_class": "connectivity",
-                "unique_id": online_unique_id,
-            }
+        topic = f"{HA_BASE_TOPIC}/device/{device_id}/config"
 
-        payload_str = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        device_info = dump_json(self.__device_info_from_config(device_id), sort_keys=True).decode()
+        # device_id comes from the MQTT topic, escape it for the JSON template
+        payload_str = (
+            get_discovery_template(known_registers)
+            .replace(DISCOVERY_DEVICE_ID, json.dumps(device_id)[1:-1])
+            .replace(f'"{DISCOVERY_DEVICE_INFO}"', device_info)
+        )
 
-        if self._discovery_payload_cache.get(device_id) == payload_str:
+        previous_payload = self._discovery_payload_cache.get(device_id)
+        if previous_payload == payload_str:
             LOG.debug("Discovery unchanged for %s, skipping", device_id)
-            if device_id not in self._discovery_cache:
-                self._discovery_cache.append(device_id)
+            self._discovery_cache.append(device_id)
             # trotzdem States aktualisieren
-            self._client.publish(f"{HA_BASE_TOPIC}/grobro/{device_id}/serial", device_id, retain=True)
-            self._client.publish(f"{HA_BASE_TOPIC}/grobro/{device_id}/type", get_device_type_name(device_id), retain=True)
+            self.__publish_device_states(device_id)
             return
 
         LOG.info("Publishing updated discovery for %s", device_id)
-        self._client.publish(topic, "", retain=True)  # force HA to refresh
+        # The components are fixed by the register set, so they can only
+        # differ from what HA has on the first publish for this device.
+        if previous_payload is None:
+            self._client.publish(topic, "", retain=True)  # force HA to refresh
         self._client.publish(topic, payload_str, retain=True)
         self._discovery_payload_cache[device_id] = payload_str
-        if device_id not in self._discovery_cache:
-            self._discovery_cache.append(device_id)
+        self._discovery_cache.append(device_id)
+
+        self.__publish_device_states(device_id)
 
+    def __publish_device_states(self, device_id: str):
         self._client.publish(f"{HA_BASE_TOPIC}/grobro/{device_id}/serial", device_id, retain=True)
         self._client.publish(f"{HA_BASE_TOPIC}/grobro/{device_id}/type", get_device_type_name(device_id), retain=True)
 
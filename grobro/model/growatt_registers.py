@@ -1,9 +1,21 @@
-from typing import Optional, Union
+from typing import Any, Callable, Optional, Union
+from dataclasses import dataclass, field
 from enum import Enum
-from pydantic import BaseModel, Field
+from functools import lru_cache
+from pydantic import BaseModel, PrivateAttr, field_validator
 import importlib.resources as resources
-import json
-import struct
+
+
+def _parse_none(data_raw: bytes):
+    return None
+
+
+def _convert_int(value: int):
+    return value
+
+
+def _parse_string(data_raw: bytes):
+    return data_raw.decode("ascii", errors="ignore").strip("\x00")
 
 
 class GrowattRegisterDataTypes(str, Enum):
@@ -30,46 +42,87 @@ class GrowattRegisterEnumOptions(BaseModel):
     enum_type: GrowattRegisterEnumTypes
     values: dict[int, str]
 
+    @field_validator("values", mode="after")
+    @classmethod
+    def _add_str_keys(cls, values: dict[int, str]) -> dict[Union[int, str], str]:
+        # register both int and str keys, so raw and already stringified
+        # values resolve with a single lookup
+        return {**values, **{str(key): value for key, value in values.items()}}
+
 
 class GrowattRegisterDataType(BaseModel):
     data_type: GrowattRegisterDataTypes
     float_options: Optional[GrowattRegisterFloatOptions] = None
     enum_options: Optional[GrowattRegisterEnumOptions] = None
 
+    _convert: Optional[Callable[[int], Any]] = PrivateAttr(default=None)
+    _parse: Callable[[bytes], Any] = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        # data_type and options never change after loading, so resolve
+        # the decode branch once instead of on every parse call.
+        self._convert = self._build_converter()
+        self._parse = self._build_parser()
+
+    @property
+    def is_signed(self) -> bool:
+        return self.data_type in [GrowattRegisterDataTypes.SIGNED_INT, GrowattRegisterDataTypes.SIGNED_FLOAT]
+
     def parse(self, data_raw: bytes):
         if not data_raw:
             return None
-        unpack_type = {1: "!B", 2: "!H", 4: "!I"}[len(data_raw)]
-        is_signed = self.data_type in [GrowattRegisterDataTypes.SIGNED_INT, GrowattRegisterDataTypes.SIGNED_FLOAT]
-        if is_signed:
-            unpack_type = unpack_type.lower()
+        return self._parse(data_raw)
+
+    def _build_parser(self) -> Callable[[bytes], Any]:
+        convert = self._convert
+        if convert is None:
+            if self.data_type == GrowattRegisterDataTypes.STRING:
+                return _parse_string
+            return _parse_none
+        signed = self.is_signed
+
+        def parse_number(data_raw: bytes):
+            return convert(int.from_bytes(data_raw, "big", signed=signed))
+
+        return parse_number
+
+    def _build_converter(self) -> Optional[Callable[[int], Any]]:
+        """
+        Returns a function mapping the raw register integer to its value,
+        or None for types that are not decoded from an integer.
+        """
         if self.data_type in [GrowattRegisterDataTypes.FLOAT, GrowattRegisterDataTypes.SIGNED_FLOAT]:
-            opts = self.float_options
-            value = struct.unpack(unpack_type, data_raw)[0]
-            value *= opts.multiplier
-            value += opts.delta
-            return round(value, 3)
+            multiplier = self.float_options.multiplier
+            delta = self.float_options.delta
+
+            def convert_float(value: int):
+                value *= multiplier
+                value += delta
+                return round(value, 3)
+
+            return convert_float
         elif self.data_type == GrowattRegisterDataTypes.TIME_HHMM:
-            value = struct.unpack(unpack_type, data_raw)[0]
-            h = value // 256
-            m = value % 256
-            return (h * 100) + m
+
+            def convert_time(value: int):
+                h = value // 256
+                m = value % 256
+                return (h * 100) + m
+
+            return convert_time
         elif self.data_type in [GrowattRegisterDataTypes.INT, GrowattRegisterDataTypes.SIGNED_INT]:
-            value = struct.unpack(unpack_type, data_raw)[0]
-            return value
+            return _convert_int
         elif self.data_type == GrowattRegisterDataTypes.ENUM:
-            opts = self.enum_options
-            value = struct.unpack(unpack_type, data_raw)[0]
-            if opts.enum_type == GrowattRegisterEnumTypes.BITFIELD:
-                return None  # TODO: implement
-            elif opts.enum_type == GrowattRegisterEnumTypes.INT_MAP:
-                enum_value = opts.values.get(int(value), None)
-                if not enum_value:
-                    return None
-                return value
-        elif self.data_type == GrowattRegisterDataTypes.STRING:
-            value = data_raw.decode("ascii", errors="ignore").strip("\x00")
-            return value
+            if self.enum_options.enum_type == GrowattRegisterEnumTypes.INT_MAP:
+                enum_values = self.enum_options.values
+
+                def convert_int_map(value: int):
+                    if not enum_values.get(value):
+                        return None
+                    return value
+
+                return convert_int_map
+            return _parse_none  # TODO: implement BITFIELD
+        return None
 
 
 class GrowattRegisterPosition(BaseModel):
@@ -82,6 +135,38 @@ class GrowattInputRegister(BaseModel):
     position: GrowattRegisterPosition
     data: GrowattRegisterDataType
 
+    _read: Callable[[Any], Any] = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        self._read = self._build_reader()
+
+    def read(self, message):
+        """
+        Reads and decodes this register from a GrowattModbusMessage.
+        Returns None if the message does not contain the register.
+        """
+        return self._read(message)
+
+    def _build_reader(self) -> Callable[[Any], Any]:
+        pos = self.position
+        convert = self.data._convert
+        parse = self.data._parse
+        if convert is None:
+
+            def read_bytes(message):
+                data_raw = message.get_data(pos)
+                return parse(data_raw) if data_raw else None
+
+            return read_bytes
+
+        signed = self.data.is_signed
+
+        def read_int(message):
+            value = message.get_int(pos, signed)
+            return None if value is None else convert(value)
+
+        return read_int
+
 
 class HomeAssistantHoldingRegister(BaseModel):
     name: str
@@ -108,23 +193,25 @@ class HomeassistantInputRegister(BaseModel):
     icon: Optional[str] = None
 
 
-class HomeAssistantHoldingRegisterValue(BaseModel):
+# Runtime state containers are created for every received message,
+# so they are plain slotted dataclasses instead of pydantic models.
+@dataclass(slots=True)
+class HomeAssistantHoldingRegisterValue:
     name: str
     value: Union[str, float, int]
-    register_def: HomeAssistantHoldingRegister = Field(alias="register")
-
-    class Config:
-        populate_by_name = True
+    register_def: HomeAssistantHoldingRegister
 
 
-class HomeAssistantHoldingRegisterInput(BaseModel):
+@dataclass(slots=True)
+class HomeAssistantHoldingRegisterInput:
     device_id: str
-    payload: list[HomeAssistantHoldingRegisterValue] = []
+    payload: list[HomeAssistantHoldingRegisterValue] = field(default_factory=list)
 
 
-class HomeAssistantInputRegister(BaseModel):
+@dataclass(slots=True)
+class HomeAssistantInputRegister:
     device_id: str
-    payload: dict[str, Union[str, float, int]] = {}
+    payload: dict[str, Union[str, float, int]] = field(default_factory=dict)
 
 
 class GroBroInputRegister(BaseModel):
@@ -141,12 +228,77 @@ class GroBroRegisters(BaseModel):
     input_registers: dict[str, GroBroInputRegister]
     holding_registers: dict[str, GroBroHoldingRegister]
 
-
-with resources.files(__package__).joinpath("growatt_neo_registers.json").open("rb") as f:
-    KNOWN_NEO_REGISTERS = GroBroRegisters.parse_obj(json.load(f))
-with resources.files(__package__).joinpath("growatt_noah_registers.json").open("rb") as f:
-    KNOWN_NOAH_REGISTERS = GroBroRegisters.parse_obj(json.load(f))
-with resources.files(__package__).joinpath("growatt_nexa_registers.json").open("rb") as f:
-    KNOWN_NEXA_REGISTERS = GroBroRegisters.parse_obj(json.load(f))
-with resources.files(__package__).joinpath("growatt_spf_registers.json").open("rb") as f:
-    KNOWN_SPF_REGISTERS = GroBroRegisters.parse_obj(json.load(f))
+    # flat (name, reader[, homeassistant]) tuples, so decoding a message
+    # does not walk the nested register models for every value
+    _input_plan: list[tuple] = PrivateAttr(default_factory=list)
+    _holding_plan: list[tuple] = PrivateAttr(default_factory=list)
+    # input register name -> enum labels, for INT_MAP registers only
+    _input_enum_values: dict[str, dict] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._input_plan = [
+            (name, register.growatt._read)
+            for name, register in self.input_registers.items()
+        ]
+        self._holding_plan = [
+            (name, register.growatt._read, register.homeassistant)
+            for name, register in self.holding_registers.items()
+            if register.growatt
+        ]
+        self._input_enum_values = {
+            name: register.growatt.data.enum_options.values
+            for name, register in self.input_registers.items()
+            if register.growatt.data.data_type == GrowattRegisterDataTypes.ENUM
+            and register.growatt.data.enum_options.enum_type == GrowattRegisterEnumTypes.INT_MAP
+        }
+
+    @property
+    def input_plan(self) -> list[tuple[str, Callable[[Any], Any]]]:
+        return self._input_plan
+
+    @property
+    def holding_plan(self) -> list[tuple[str, Callable[[Any], Any], HomeAssistantHoldingRegister]]:
+        return self._holding_plan
+
+    @property
+    def input_enum_values(self) -> dict[str, dict[Union[int, str], str]]:
+        return self._input_enum_values
+
+
+def _load_registers(file_name: str) -> GroBroRegisters:
+    # let pydantic-core parse the JSON bytes directly instead of
+    # building an intermediate dict tree with json.load first
+    return GroBroRegisters.model_validate_json(
+        resources.files(__package__).joinpath(file_name).read_bytes()
+    )
+
+
+KNOWN_NEO_REGISTERS = _load_registers("growatt_neo_registers.json")
+KNOWN_NOAH_REGISTERS = _load_registers("growatt_noah_registers.json")
+KNOWN_NEXA_REGISTERS = _load_registers("growatt_nexa_registers.json")
+KNOWN_SPF_REGISTERS = _load_registers("growatt_spf_registers.json")
+
+# device_id prefix -> (register set, device type name)
+DEVICE_TYPES = (
+    ("QMN", KNOWN_NEO_REGISTERS, "NEO"),
+    ("0PVP", KNOWN_NOAH_REGISTERS, "NOAH"),
+    ("0HVR", KNOWN_NEXA_REGISTERS, "NEXA"),
+    ("HAQ", KNOWN_SPF_REGISTERS, "SPF"),
+)
+
+
+@lru_cache(maxsize=4096)
+def get_known_registers(device_id: str) -> Optional[GroBroRegisters]:
+    """Returns the register set matching the device_id prefix."""
+    for prefix, registers, _ in DEVICE_TYPES:
+        if device_id.startswith(prefix):
+            return registers
+    return None
+
+
+def get_device_type_name(device_id: str) -> str:
+    """Returns the device type name matching the device_id prefix."""
+    for prefix, _, type_name in DEVICE_TYPES:
+        if device_id.startswith(prefix):
+            return type_name
+    return "UNKNOWN"
@@ -1,10 +1,11 @@
-from grobro.model.modbus_message import GrowattModbusFunction
+from grobro.model.modbus_message import GrowattModbusFunction, decode_padded, encode_padded
 import struct
 from pydantic import BaseModel, Field
 from enum import Enum
 from typing import Optional
 
 MODBUS_COMMAND_STRUCT = ">HHHBB30sHH"
+_CMD = struct.Struct(MODBUS_COMMAND_STRUCT)
 
 
 class GrowattModbusFunctionMultiple(BaseModel):
@@ -41,28 +42,28 @@ class GrowattModbusFunctionMultiple(BaseModel):
             device_id_raw,
             start,
             end,
-        ) = struct.unpack(MODBUS_COMMAND_STRUCT, buffer[0:42])
+        ) = _CMD.unpack_from(buffer, 0)
 
-        device_id = device_id_raw.decode("ascii", errors="ignore").strip("\x00")
+        device_id = decode_padded(device_id_raw)
         values = buffer[42:]
 
-        return GrowattModbusFunctionMultiple(
+        # fields are decoded from a fixed binary layout, skip validation
+        return GrowattModbusFunctionMultiple.model_construct(
             device_id=device_id,
-            function=function,
+            function=GrowattModbusFunction(function),
             start=start,
             end=end,
             values=values,
         )
 
     def build_grobro(self) -> bytes:
-        header = struct.pack(
-            MODBUS_COMMAND_STRUCT,
+        header = _CMD.pack(
             1,
             7,
             36 + len(self.values),
             1,
             self.function,
-            self.device_id.encode("ascii").ljust(30, b"\x00"),
+            encode_padded(self.device_id),
             self.start,
             self.end,
         )
@@ -101,26 +102,26 @@ class GrowattModbusFunctionSingle(BaseModel):
             device_id_raw,
             register,
             value,
-        ) = struct.unpack(MODBUS_COMMAND_STRUCT, buffer[0:42])
+        ) = _CMD.unpack_from(buffer, 0)
 
-        device_id = device_id_raw.decode("ascii", errors="ignore").strip("\x00")
+        device_id = decode_padded(device_id_raw)
 
-        return GrowattModbusFunctionSingle(
+        # fields are decoded from a fixed binary layout, skip validation
+        return GrowattModbusFunctionSingle.model_construct(
             device_id=device_id,
-            function=function,
+            function=GrowattModbusFunction(function),
             register_no=register,
             value=value,
         )
 
     def build_grobro(self) -> bytes:
-        return struct.pack(
-            MODBUS_COMMAND_STRUCT,
+        return _CMD.pack(
             1,
             7,
             36,
             1,
             self.function,
-            self.device_id.encode("ascii").ljust(30, b"\x00"),
+            encode_padded(self.device_id),
             self.register_no,
             self.value,
         )
@@ -3,17 +3,45 @@ from typing import Optional
 from datetime import datetime
 import struct
 import logging
-from pydantic.main import BaseModel
-from enum import Enum
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from functools import lru_cache
+from enum import IntEnum
 from pylint.checkers.base import register
 from grobro.model.growatt_registers import GrowattRegisterPosition
 
 LOG = logging.getLogger(__name__)
 
 HEADER_STRUCT = ">HHHBB30s"
+_HDR = struct.Struct(HEADER_STRUCT)
+_BLK = struct.Struct(">HH")
+_META = struct.Struct(">30s7B")
 
 
-class GrowattModbusBlock(BaseModel):
+def decode_padded(raw: bytes) -> str:
+    """
+    Decodes a zero padded ascii field, cutting at the first zero byte
+    so the padding is never decoded.
+    """
+    end = raw.find(b"\x00")
+    return (raw if end < 0 else raw[:end]).decode("ascii", errors="ignore")
+
+
+@lru_cache(maxsize=1024)
+def encode_padded(value: str) -> bytes:
+    """
+    Encodes value as a 30 byte zero padded ascii field.
+    Cached, since the same few device ids are encoded for every frame.
+    """
+    return value.encode("ascii").ljust(30, b"\x00")
+
+
+# The parsed frame types are only ever built from already decoded binary
+# data, so they are plain slotted dataclasses instead of pydantic models.
+# They are frozen, so the lazily decoded words and block index cached on
+# them can never go stale.
+@dataclass(slots=True, kw_only=True, frozen=True)
+class GrowattModbusBlock:
     """
     Represents a block of modbus registers.
     start, end are the number of the first and last register included.
@@ -29,28 +57,43 @@ class GrowattModbusBlock(BaseModel):
     end: int
     values: bytes
 
-    @staticmethod
-    def parse_grobro(buffer) -> Optional["GrowattModbusBlock"]:
-        try:
-            (start, end) = struct.unpack(">HH", buffer[0:4])
-            num_blocks = end - start + 1
-            result = GrowattModbusBlock(
-                start=start, end=end, values=buffer[4 : 4 + num_blocks * 2]
+    _words: Optional[tuple[int, ...]] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def words(self) -> tuple[int, ...]:
+        """
+        All register values of the block as unsigned 16 bit integers,
+        decoded with a single unpack call on first access.
+        """
+        if self._words is None:
+            object.__setattr__(
+                self, "_words", struct.unpack(f">{len(self.values) // 2}H", self.values)
             )
-            assert len(result.values) == num_blocks * 2
-            return result
-        except Exception as e:
-            LOG.warn("Parsing GrowattModbusBlock: %s", e)
+        return self._words
+
+    @staticmethod
+    def parse_grobro(buffer, offset: int = 0) -> Optional["GrowattModbusBlock"]:
+        if len(buffer) < offset + _BLK.size:
+            LOG.warning("Parsing GrowattModbusBlock: truncated block header")
+            return None
+        (start, end) = _BLK.unpack_from(buffer, offset)
+        num_blocks = end - start + 1
+        values_start = offset + _BLK.size
+        values = buffer[values_start : values_start + num_blocks * 2]
+        if len(values) != num_blocks * 2:
+            LOG.warning("Parsing GrowattModbusBlock: expected %s registers from %s", num_blocks, start)
+            return None
+        return GrowattModbusBlock(start=start, end=end, values=values)
 
     def build_grobro(self) -> bytes:
-        result = struct.pack(">HH", self.start, self.end) + self.values
+        result = _BLK.pack(self.start, self.end) + self.values
         return result
 
     def size(self):
         return 4 + len(self.values)
 
 
-class GrowattModbusFunction(int, Enum):
+class GrowattModbusFunction(IntEnum):
     READ_HOLDING_REGISTER = 3
     READ_INPUT_REGISTER = 4
     READ_SINGLE_REGISTER = 5
@@ -58,7 +101,12 @@ class GrowattModbusFunction(int, Enum):
     PRESET_MULTIPLE_REGISTER = 16
 
 
-class GrowattMetadata(BaseModel):
+# resolved once, so incoming frames are checked with a single dict lookup
+_FUNC_BY_VALUE = {e.value: e for e in GrowattModbusFunction}
+
+
+@dataclass(slots=True, kw_only=True, frozen=True)
+class GrowattMetadata:
     """
     Represents metadata within a READ_INPUT_REGISTER message.
 
@@ -68,45 +116,54 @@ class GrowattMetadata(BaseModel):
     """
 
     device_sn: str
-    timestamp: Optional[datetime]
+    # year - 2000, month, day, hour, minute, second, millis as sent
+    timestamp_raw: tuple[int, int, int, int, int, int, int]
 
     def size(self):
         return 37
 
-    @staticmethod
-    def parse_grobro(buffer) -> Optional["GrowattMetadata"]:
-        offset = 0
-        device_serial_raw = struct.unpack(">30s", buffer[offset : offset + 30])[0]
-        device_serial = device_serial_raw.decode("ascii", errors="ignore").strip("\x00")
-        offset += 30
-        year, month, day, hour, minute, second, millis = struct.unpack(
-            ">7B", buffer[offset : offset + 7]
-        )
-        timestamp = None
+    @property
+    def timestamp(self) -> Optional[datetime]:
+        """
+        The decoded timestamp, or None if the device sent an invalid one.
+        Only built on access, most consumers never read it.
+        """
+        year, month, day, hour, minute, second, millis = self.timestamp_raw
         try:
-            timestamp = datetime(
+            return datetime(
                 year + 2000, month, day, hour, minute, second, microsecond=millis * 1000
             )
-        except Exception:
-            pass
-        return GrowattMetadata(device_sn=device_serial, timestamp=timestamp)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def parse_grobro(buffer, offset: int = 0) -> Optional["GrowattMetadata"]:
+        if len(buffer) < offset + _META.size:
+            return None
+        (device_serial_raw, *timestamp_raw) = _META.unpack_from(buffer, offset)
+        return GrowattMetadata(
+            device_sn=decode_padded(device_serial_raw), timestamp_raw=tuple(timestamp_raw)
+        )
 
     def build_grobro(self) -> bytes:
-        result = struct.pack(
-            ">30s7B",
-            self.device_sn.encode("ascii").ljust(30, b"\x00"),  # device_id
-            self.timestamp.year - 2000,
-            self.timestamp.month,
-            self.timestamp.day,
-            self.timestamp.hour,
-            self.timestamp.minute,
-            self.timestamp.second,
-            int(self.timestamp.microsecond / 1000),
+        result = bytearray(_META.size)
+        self.pack_into(result, 0)
+        return bytes(result)
+
+    def pack_into(self, buffer: bytearray, offset: int):
+        """
+        Writes the metadata into buffer at offset.
+        """
+        _META.pack_into(
+            buffer,
+            offset,
+            encode_padded(self.device_sn),  # device_id
+            *self.timestamp_raw,
         )
-        return result
 
 
-class GrowattModbusMessage(BaseModel):
+@dataclass(slots=True, kw_only=True, frozen=True)
+class GrowattModbusMessage:
     """
     Represents a block of modbus registers sent by the growatt device.
 
@@ -125,7 +182,17 @@ class GrowattModbusMessage(BaseModel):
     device_id: str
     metadata: Optional[GrowattMetadata] = None
     function: GrowattModbusFunction
-    register_blocks: list[GrowattModbusBlock]
+    register_blocks: tuple[GrowattModbusBlock, ...]
+
+    # (block starts, blocks) sorted by start register, built on first lookup.
+    # starts is None if blocks overlap, lookups then scan in frame order.
+    _block_index: Optional[tuple[Optional[list[int]], tuple[GrowattModbusBlock, ...]]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        # store blocks as a tuple, so the cached block index matches them for good
+        object.__setattr__(self, "register_blocks", tuple(self.register_blocks))
 
     @property
     def msg_len(self):
@@ -136,65 +203,124 @@ class GrowattModbusMessage(BaseModel):
             result += block.size()
         return result
 
+    def get_block(self, register_no: int) -> Optional[GrowattModbusBlock]:
+        """
+        Returns the register block containing register_no, or None.
+        """
+        if self._block_index is None:
+            blocks = tuple(sorted(self.register_blocks, key=lambda block: block.start))
+            if any(prev.end >= block.start for prev, block in zip(blocks, blocks[1:])):
+                block_index = (None, self.register_blocks)
+            else:
+                block_index = ([block.start for block in blocks], blocks)
+            object.__setattr__(self, "_block_index", block_index)
+        starts, blocks = self._block_index
+        if starts is None:
+            # overlapping blocks, the first block in the frame wins
+            for block in blocks:
+                if block.start <= register_no <= block.end:
+                    return block
+            return None
+        i = bisect_right(starts, register_no) - 1
+        if i < 0 or blocks[i].end < register_no:
+            return None
+        return blocks[i]
+
     def get_data(self, pos: GrowattRegisterPosition):
-        for block in self.register_blocks:
-            if block.start > pos.register_no or block.end < pos.register_no:
-                continue
-            block_pos = (pos.register_no - block.start) * 2 + pos.offset
-            return block.values[block_pos : block_pos + pos.size]
-        return None
+        block = self.get_block(pos.register_no)
+        if block is None:
+            return None
+        block_pos = (pos.register_no - block.start) * 2 + pos.offset
+        return block.values[block_pos : block_pos + pos.size]
+
+    def get_int(self, pos: GrowattRegisterPosition, signed: bool = False) -> Optional[int]:
+        """
+        Returns the big-endian integer at pos, read from the pre-decoded
+        words of the containing block instead of slicing and unpacking bytes.
+        """
+        block = self.get_block(pos.register_no)
+        if block is None:
+            return None
+        words = block.words
+        index = pos.register_no - block.start
+        if pos.size == 2 and pos.offset == 0:
+            value = words[index]
+        elif pos.size == 4 and pos.offset == 0 and index + 1 < len(words):
+            value = (words[index] << 16) | words[index + 1]
+        elif pos.size == 1 and pos.offset == 0:
+            value = words[index] >> 8
+        elif pos.size == 1 and pos.offset == 1:
+            value = words[index] & 0xFF
+        else:
+            # unaligned or truncated register, decode the raw bytes
+            data_raw = self.get_data(pos)
+            return int.from_bytes(data_raw, "big", signed=signed) if data_raw else None
+        if signed and value >> (pos.size * 8 - 1):
+            value -= 1 << (pos.size * 8)
+        return value
 
     @staticmethod
     def parse_grobro(buffer) -> Optional["GrowattModbusMessage"]:
-        try:
-            (unknown, constant_7, msg_len, constant_1, function, device_id_raw) = (
-                struct.unpack(
-                    HEADER_STRUCT,
-                    buffer[0:38],
-                )
-            )
-            if msg_len != len(buffer[8:]):
+        if len(buffer) < _HDR.size:
+            return None
+        (unknown, constant_7, msg_len, constant_1, function, device_id_raw) = (
+            _HDR.unpack_from(buffer, 0)
+        )
+        if msg_len != len(buffer) - 8:
+            return None
+        device_id = decode_padded(device_id_raw)
+        if function not in _FUNC_BY_VALUE:
+            LOG.info("Unknown modbus function for %s: %s", device_id, function)
+            return None
+        function = _FUNC_BY_VALUE[function]
+
+        register_blocks = []
+        offset = _HDR.size
+
+        metadata = None
+        if function == GrowattModbusFunction.READ_INPUT_REGISTER:
+            metadata = GrowattMetadata.parse_grobro(buffer, offset)
+            if metadata is None:
+                LOG.warning("parsing GrowattModbusMessage: truncated metadata from %s", device_id)
                 return None
-            device_id = device_id_raw.decode("ascii", errors="ignore").strip("\x00")
-            if function not in [e.value for e in GrowattModbusFunction]:
-                LOG.info("Unknown modbus function for %s: %s", device_id, function)
+            offset += metadata.size()
+
+        while len(buffer) > offset + 6:
+            block = GrowattModbusBlock.parse_grobro(buffer, offset)
+            if block is None:
                 return None
+            register_blocks.append(block)
+            offset += block.size()
 
-            register_blocks = []
-            offset = 38
-
-            metadata = None
-            if function == GrowattModbusFunction.READ_INPUT_REGISTER:
-                metadata = GrowattMetadata.parse_grobro(buffer[offset:])
-                offset += metadata.size()
-
-            while len(buffer) > offset + 6:
-                block = GrowattModbusBlock.parse_grobro(buffer[offset:])
-                register_blocks.append(block)
-                offset += block.size()
-
-            return GrowattModbusMessage(
-                unknown=unknown,
-                metadata=metadata,
-                device_id=device_id,
-                function=function,
-                register_blocks=register_blocks,
-            )
-        except Exception as e:
-            LOG.warn("parsing GrowattModbusMessage: %s", e)
+        return GrowattModbusMessage(
+            unknown=unknown,
+            metadata=metadata,
+            device_id=device_id,
+            function=function,
+            register_blocks=register_blocks,
+        )
 
     def build_grobro(self) -> bytes:
-        result = struct.pack(
-            HEADER_STRUCT,
+        msg_len = self.msg_len
+        # write all parts into one preallocated buffer instead of
+        # concatenating (and copying) the result for every block
+        result = bytearray(6 + msg_len)  # msg_len excludes the first 6 header bytes
+        _HDR.pack_into(
+            result,
+            0,
             self.unknown,
             7,
-            self.msg_len,
+            msg_len,
             1,
             self.function,
-            self.device_id.encode("ascii").ljust(30, b"\x00"),  # device_id
+            encode_padded(self.device_id),  # device_id
         )
+        offset = _HDR.size
         if self.metadata:
-            result += self.metadata.build_grobro()
+            self.metadata.pack_into(result, offset)
+            offset += self.metadata.size()
         for block in self.register_blocks:
-            result += block.build_grobro()
-        return result
+            _BLK.pack_into(result, offset, block.start, block.end)
+            result[offset + 4 : offset + block.size()] = block.values
+            offset += block.size()
+        return bytes(result)